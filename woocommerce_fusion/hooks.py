@@ -131,6 +131,7 @@ doc_events = {
 		"on_submit": "woocommerce_fusion.tasks.sync_sales_orders.run_sales_order_sync_from_hook"
 	},
 	"Item": {
+		"validate": "woocommerce_fusion.woocommerce.doctype.item_woocommerce_server.item_woocommerce_server.validate_item_woocommerce_servers",
 		"on_update": "woocommerce_fusion.tasks.sync_items.run_item_sync_from_hook",
 		"after_insert": "woocommerce_fusion.tasks.sync_items.run_item_sync_from_hook",
 	},
@@ -1,8 +1,24 @@
 import math
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Dict, List, Tuple
 
 import frappe
+from requests import Response
 
-from woocommerce_fusion.tasks.utils import APIWithRequestLogging
+from woocommerce_fusion.tasks.utils import get_woocommerce_api
+from woocommerce_fusion.woocommerce.doctype.item_woocommerce_server.item_woocommerce_server import (
+	ItemWooCommerceServer,
+)
+from woocommerce_fusion.woocommerce.doctype.woocommerce_server.woocommerce_server import (
+	WooCommerceServer,
+)
+
+# Maximum number of products that can be updated in a single WooCommerce batch request
+WC_BATCH_LIMIT = 100
+# Maximum number of WooCommerce sites that are updated concurrently
+WC_MAX_CONCURRENT_SERVERS = 8
 
 
 def update_stock_levels_for_woocommerce_item(doc, method):
@@ -20,13 +36,26 @@ def update_stock_levels_for_woocommerce_item(doc, method):
 				if doc.doctype == "Sales Invoice":
 					if doc.update_stock == 0:
 						return
-				item_codes = [row.item_code for row in doc.items]
-				for item_code in item_codes:
-					frappe.enqueue(
-						"woocommerce_fusion.tasks.stock_update.update_stock_levels_on_woocommerce_site",
-						enqueue_after_commit=True,
-						item_code=item_code,
+				# Remove duplicate item codes, while preserving their order
+				item_codes = list(dict.fromkeys(row.item_code for row in doc.items))
+
+				# Only update items that are linked to a WooCommerce Product
+				linked_item_codes = set(
+					frappe.get_all(
+						"Item WooCommerce Server",
+						filters={"parenttype": "Item", "parent": ["in", item_codes], "enabled": 1},
+						pluck="parent",
 					)
+				)
+				item_codes = [item_code for item_code in item_codes if item_code in linked_item_codes]
+				if not item_codes:
+					return
+
+				frappe.enqueue(
+					"woocommerce_fusion.tasks.stock_update.update_stock_levels_on_woocommerce_site_bulk",
+					enqueue_after_commit=True,
+					item_codes=item_codes,
+				)
 
 
 def update_stock_levels_for_all_enabled_items_in_background():
@@ -57,6 +86,66 @@ def update_stock_levels_for_all_enabled_items_in_background():
 		)
 
 
+def update_stock_levels_on_woocommerce_site_bulk(item_codes: List[str]):
+	"""
+	Updates stock levels of a list of items on all their associated WooCommerce sites.
+
+	The stock levels of all the items are fetched with a single query per WooCommerce Server, so
+	that a stock transaction with many lines results in a single background job instead of one
+	job per item. The updated stock levels are then posted to all WooCommerce sites concurrently,
+	using batch requests. Products of which the stock level did not change since it was last
+	posted are skipped.
+	"""
+	wc_servers = get_wc_servers_with_stock_sync()
+	if not wc_servers:
+		return
+
+	stock_levels_by_server = get_stock_levels_by_server(item_codes, wc_servers)
+
+	# Group the stock level updates by WooCommerce Server
+	updates_by_server = defaultdict(list)
+	for item_code in item_codes:
+		item = frappe.get_cached_doc("Item", item_code)
+		if not is_item_stock_synchronised(item):
+			continue
+		for wc_site, update in get_stock_level_updates(item, stock_levels_by_server, wc_servers):
+			# Skip products of which the stock level did not change since it was last posted
+			if str(update["stock_quantity"]) == wc_site.woocommerce_last_pushed_stock:
+				continue
+			updates_by_server[wc_site.woocommerce_server].append((wc_site, update))
+
+	if not updates_by_server:
+		return
+
+	# Post the updates to all WooCommerce sites concurrently, as the requests are network-bound.
+	# Only the HTTP requests run in the worker threads, the responses are handled in this thread
+	failed_servers = []
+	with ThreadPoolExecutor(
+		max_workers=min(WC_MAX_CONCURRENT_SERVERS, len(updates_by_server))
+	) as executor:
+		futures = {}
+		for server_name, updates in updates_by_server.items():
+			wc_api = get_woocommerce_api(wc_servers[server_name])
+			future = executor.submit(copy_context().run, post_stock_level_batches, wc_api, updates)
+			futures[future] = (server_name, wc_api, updates)
+
+		for future in as_completed(futures):
+			server_name, wc_api, updates = futures[future]
+			try:
+				process_stock_level_batch_responses(wc_api, future.result())
+			except Exception:
+				data_to_post = [update for wc_site, update in updates]
+				error_message = f"{frappe.get_traceback()}\n\nData in POST requests: \n{str(data_to_post)}"
+				frappe.log_error("WooCommerce Error", error_message)
+				failed_servers.append(server_name)
+
+	# Fail the background job once all servers have been handled, so that failures are not hidden
+	if failed_servers:
+		raise ValueError(
+			f"Stock levels could not be updated on WooCommerce Servers: {', '.join(failed_servers)}"
+		)
+
+
 @frappe.whitelist()
 def update_stock_levels_on_woocommerce_site(item_code):
 	"""
@@ -66,63 +155,171 @@ def update_stock_levels_on_woocommerce_site(item_code):
 	WooCommerce site, it retrieves the current inventory, calculates the new stock quantity,
 	and posts the updated stock levels back to the WooCommerce site.
 	"""
-	item = frappe.get_doc("Item", item_code)
-
-	if len(item.woocommerce_servers) == 0 or not item.is_stock_item or item.disabled:
+	item = frappe.get_cached_doc("Item", item_code)
+	if not is_item_stock_synchronised(item):
 		return False
-	else:
-		bins = frappe.get_list(
-			"Bin", {"item_code": item_code}, ["name", "warehouse", "reserved_qty", "actual_qty"]
-		)
 
-		for wc_site in item.woocommerce_servers:
-			woocommerce_id = wc_site.woocommerce_id
-			woocommerce_server = wc_site.woocommerce_server
-			wc_server = frappe.get_cached_doc("WooCommerce Server", woocommerce_server)
+	wc_servers = get_wc_servers_with_stock_sync()
+	stock_levels_by_server = get_stock_levels_by_server([item_code], wc_servers)
 
-			if (
-				not wc_server
-				or not wc_server.enable_sync
-				or not wc_site.enabled
-				or not wc_server.enable_stock_level_synchronisation
-			):
-				continue
+	for wc_site, update in get_stock_level_updates(item, stock_levels_by_server, wc_servers):
+		wc_api = get_woocommerce_api(wc_servers[wc_site.woocommerce_server])
+		try:
+			put_stock_level_update(wc_api, update)
+		except Exception as err:
+			error_message = f"{frappe.get_traceback()}\n\nData in PUT request: \n{str(update)}"
+			frappe.log_error("WooCommerce Error", error_message)
+			raise err
+		set_last_pushed_stock_level(wc_site, update)
+
+	return True
+
+
+def is_item_stock_synchronised(item) -> bool:
+	"""
+	Check if an Item is linked to WooCommerce and should have its stock levels synchronised
+	"""
+	return len(item.woocommerce_servers) > 0 and bool(item.is_stock_item) and not item.disabled
+
+
+def get_wc_servers_with_stock_sync() -> Dict[str, WooCommerceServer]:
+	"""
+	Get all WooCommerce Servers with sync and stock level synchronisation enabled, keyed by name
+	"""
+	wc_servers = frappe.get_all(
+		"WooCommerce Server", filters={"enable_sync": 1, "enable_stock_level_synchronisation": 1}
+	)
+	return {
+		server.name: frappe.get_cached_doc("WooCommerce Server", server.name) for server in wc_servers
+	}
+
+
+def get_stock_levels_by_server(
+	item_codes: List[str], wc_servers: Dict[str, WooCommerceServer]
+) -> Dict[str, Dict[str, float]]:
+	"""
+	Get the total quantity of a list of items in the warehouses of each WooCommerce Server,
+	keyed by WooCommerce Server name and item_code
 
-			wc_api = APIWithRequestLogging(
-				url=wc_server.woocommerce_server_url,
-				consumer_key=wc_server.api_consumer_key,
-				consumer_secret=wc_server.api_consumer_secret,
-				version="wc/v3",
-				timeout=40,
+	Quantities are summed in the database, with a single query per WooCommerce Server
+	"""
+	stock_levels_by_server = {}
+	for name, wc_server in wc_servers.items():
+		warehouses = [row.warehouse for row in wc_server.warehouses]
+		stock_levels = (
+			frappe.get_all(
+				"Bin",
+				filters={"item_code": ["in", item_codes], "warehouse": ["in", warehouses]},
+				fields=["item_code", "sum(actual_qty) as actual_qty"],
+				group_by="item_code",
 			)
+			if warehouses
+			else []
+		)
+		stock_levels_by_server[name] = {row.item_code: row.actual_qty for row in stock_levels}
 
-			# Sum all quantities from select warehouses and round the total down (WooCommerce API doesn't accept float values)
-			data_to_post = {
-				"manage_stock": True,
-				"stock_quantity": math.floor(
-					sum(
-						bin.actual_qty
-						for bin in bins
-						if bin.warehouse in [row.warehouse for row in wc_server.warehouses]
-					)
-				),
-			}
+	return stock_levels_by_server
+
+
+def get_stock_level_updates(
+	item,
+	stock_levels_by_server: Dict[str, Dict[str, float]],
+	wc_servers: Dict[str, WooCommerceServer],
+) -> List[Tuple[ItemWooCommerceServer, Dict]]:
+	"""
+	Get the stock level updates of an item for all its associated WooCommerce sites,
+	as a list of (Item WooCommerce Server row, product data) tuples
+
+	Only sites of which the WooCommerce Server is present in wc_servers are included
+	"""
+	updates = []
+	for wc_site in item.woocommerce_servers:
+		if wc_site.woocommerce_server not in wc_servers or not wc_site.enabled:
+			continue
+
+		stock_levels = stock_levels_by_server.get(wc_site.woocommerce_server, {})
+
+		# Round the total quantity from select warehouses down
+		# (WooCommerce API doesn't accept float values)
+		update = {
+			"id": wc_site.woocommerce_id,
+			"manage_stock": True,
+			"stock_quantity": math.floor(stock_levels.get(item.name) or 0),
+		}
+		updates.append((wc_site, update))
+
+	return updates
+
+
+def post_stock_level_batches(
+	wc_api, updates: List[Tuple[ItemWooCommerceServer, Dict]]
+) -> List[Tuple[List[Tuple[ItemWooCommerceServer, Dict]], Response]]:
+	"""
+	Post stock level updates for many products to a WooCommerce site using the products/batch
+	endpoint, with at most WC_BATCH_LIMIT products per request.
+
+	Returns a list of (updates, response) tuples. Only the HTTP requests are made here, so that
+	this function can run in a worker thread without touching the database
+	"""
+	batches = []
+	for start in range(0, len(updates), WC_BATCH_LIMIT):
+		chunk = updates[start : start + WC_BATCH_LIMIT]
+		data_to_post = {"update": [update for wc_site, update in chunk]}
+		batches.append((chunk, wc_api.post("products/batch", data=data_to_post)))
+
+	return batches
+
+
+def process_stock_level_batch_responses(
+	wc_api, batches: List[Tuple[List[Tuple[ItemWooCommerceServer, Dict]], Response]]
+):
+	"""
+	Check the responses of stock level batch requests and store the posted stock levels.
+
+	Products that could not be updated in a batch are retried with a separate PUT request.
+	Errors are raised without being logged, as they are logged by the caller
+	"""
+	for chunk, response in batches:
+		response.raise_for_status()  # Raise an error for bad responses
+
+		# The batch response lists the results in the same order as the request
+		for (wc_site, update), result in zip(chunk, response.json().get("update", [])):
+			if "error" in result:
+				put_stock_level_update(wc_api, update)
+			set_last_pushed_stock_level(wc_site, update)
 
-			try:
-				response = wc_api.put(endpoint=f"products/{woocommerce_id}", data=data_to_post)
-				response.raise_for_status()  # Raise an error for bad responses
-			except Exception as err:
-				error_message = f"{frappe.get_traceback()}\n\nData in PUT request: \n{str(data_to_post)}"
-				frappe.log_error("WooCommerce Error", error_message)
-				raise err
-			if response.status_code != 200:
-				error_message = f"Status Code not 200\n\nData in PUT request: \n{str(data_to_post)}"
-				error_message += (
-					f"\n\nResponse: \n{response.status_code}\nResponse Text: {response.text}\nRequest URL: {response.request.url}\nRequest Body: {response.request.body}"
-					if response is not None
-					else ""
-				)
-				frappe.log_error("WooCommerce Error", error_message)
-				raise ValueError(error_message)
 
-		return True
+def put_stock_level_update(wc_api, update: Dict):
+	"""
+	Post a stock level update for a single product to a WooCommerce site.
+
+	Errors are raised without being logged, as they are logged by the caller
+	"""
+	data_to_post = {key: value for key, value in update.items() if key != "id"}
+
+	response = wc_api.put(endpoint=f"products/{update['id']}", data=data_to_post)
+	response.raise_for_status()  # Raise an error for bad responses
+	if response.status_code != 200:
+		error_message = f"Status Code not 200\n\nData in PUT request: \n{str(data_to_post)}"
+		error_message += (
+			f"\n\nResponse: \n{response.status_code}\nResponse Text: {response.text}\nRequest URL: {response.request.url}\nRequest Body: {response.request.body}"
+			if response is not None
+			else ""
+		)
+		raise ValueError(error_message)
+
+
+def set_last_pushed_stock_level(wc_site: ItemWooCommerceServer, update: Dict):
+	"""
+	Store the stock level that was posted to WooCommerce using db.set_value, as it does not call
+	the ORM triggers and it does not update the modified timestamp
+	"""
+	frappe.db.set_value(
+		"Item WooCommerce Server",
+		wc_site.name,
+		"woocommerce_last_pushed_stock",
+		str(update["stock_quantity"]),
+		update_modified=False,
+	)
+	# Items are read from the document cache, which isn't cleared by db.set_value
+	frappe.clear_document_cache("Item", wc_site.parent)
@@ -1,7 +1,9 @@
 import json
+from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional, Tuple
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
 
 # import base64
 # from httpx import post
@@ -11,11 +13,12 @@ import pytz
 from erpnext.stock.doctype.item.item import Item
 from frappe import _, _dict
 from frappe.query_builder import Criterion
-from frappe.utils import get_datetime, now
+from frappe.utils import get_datetime, getdate, now
+from frappe.utils.caching import request_cache
 
 from woocommerce_fusion.exceptions import SyncDisabledError
 from woocommerce_fusion.tasks.sync import SynchroniseWooCommerce
-from woocommerce_fusion.tasks.utils import APIWithRequestLogging
+from woocommerce_fusion.tasks.utils import get_woocommerce_api
 from woocommerce_fusion.woocommerce.doctype.woocommerce_product.woocommerce_product import (
 	WooCommerceProduct,
 )
@@ -26,6 +29,9 @@ from woocommerce_fusion.woocommerce.woocommerce_api import (
 	generate_woocommerce_record_name_from_domain_and_id,
 )
 
+# Number of WooCommerce Products to synchronise per background job
+ITEM_SYNC_CHUNK_SIZE = 25
+
 
 def run_item_sync_from_hook(doc, method):
 	"""
@@ -36,11 +42,13 @@ def run_item_sync_from_hook(doc, method):
 		and not doc.flags.get("created_by_sync", None)
 		and len(doc.woocommerce_servers) > 0
 	):
-		frappe.msgprint(
-			_("Background sync to WooCommerce triggered for {}").format(frappe.bold(doc.name)),
-			indicator="blue",
-			alert=True,
-		)
+		wc_settings = frappe.get_cached_doc("WooCommerce Integration Settings")
+		if wc_settings.show_sync_notifications:
+			frappe.msgprint(
+				_("Background sync to WooCommerce triggered for {}").format(frappe.bold(doc.name)),
+				indicator="blue",
+				alert=True,
+			)
 		frappe.enqueue(clear_sync_hash_and_run_item_sync, item_code=doc.name)
 
 
@@ -66,10 +74,7 @@ def run_item_sync(
 	# Get ERPNext Item and WooCommerce product if they exist
 	if woocommerce_product or woocommerce_product_name:
 		if not woocommerce_product:
-			woocommerce_product = frappe.get_doc(
-				{"doctype": "WooCommerce Product", "name": woocommerce_product_name}
-			)
-			woocommerce_product.load_from_db()
+			woocommerce_product = frappe.get_doc("WooCommerce Product", woocommerce_product_name)
 
 		# Trigger sync
 		sync = SynchroniseItem(woocommerce_product=woocommerce_product)
@@ -99,11 +104,31 @@ def run_item_sync(
 	)
 
 
+def run_item_sync_bulk(woocommerce_products: List[WooCommerceProduct]):
+	"""
+	Synchronise a list of WooCommerce Products with their ERPNext Items in a single background job
+
+	Each product is synchronised within its own savepoint, so that the partial writes of a product
+	that fails to synchronise are rolled back without losing the other products' changes
+	"""
+	save_point = "run_item_sync"
+	for woocommerce_product in woocommerce_products:
+		frappe.db.savepoint(save_point)
+		try:
+			run_item_sync(woocommerce_product=woocommerce_product)
+		except Exception:
+			frappe.db.rollback(save_point=save_point)
+			# Log the error after the rollback, as the rollback also discards any Error Log created
+			# during the synchronisation
+			error_message = f"{frappe.get_traceback()}\n\nWC Product: {woocommerce_product.name}"
+			frappe.log_error("WooCommerce Error", error_message)
+
+
 def sync_woocommerce_products_modified_since(date_time_from=None):
 	"""
 	Get list of WooCommerce products modified since date_time_from
 	"""
-	wc_settings = frappe.get_doc("WooCommerce Integration Settings")
+	wc_settings = frappe.get_cached_doc("WooCommerce Integration Settings")
 
 	if not date_time_from:
 		date_time_from = wc_settings.wc_last_sync_date_items
@@ -119,15 +144,18 @@ def sync_woocommerce_products_modified_since(date_time_from=None):
 		)
 		raise ValueError(error_text)
 
-	wc_products = get_list_of_wc_products(date_time_from=date_time_from)
-	for wc_product in wc_products:
-		try:
-			run_item_sync(woocommerce_product=wc_product, enqueue=True)
-		# Skip items with errors, as these exceptions will be logged
-		except Exception:
-			pass
+	wc_products = iter_wc_products(date_time_from=date_time_from)
+
+	# Synchronise products in chunks, to avoid the overhead of a background job per product
+	while chunk := list(islice(wc_products, ITEM_SYNC_CHUNK_SIZE)):
+		frappe.enqueue(
+			"woocommerce_fusion.tasks.sync_items.run_item_sync_bulk",
+			queue="long",
+			woocommerce_products=chunk,
+		)
 
-	wc_settings.reload()
+	# Get a fresh copy of the settings, as the cached document should not be modified
+	wc_settings = frappe.get_doc("WooCommerce Integration Settings")
 	wc_settings.wc_last_sync_date_items = now()
 	wc_settings.flags.ignore_mandatory = True
 	wc_settings.save()
@@ -172,6 +200,15 @@ class SynchroniseItem(SynchroniseWooCommerce):
 		self.item = item
 		self.woocommerce_product = woocommerce_product
 		self.settings = frappe.get_cached_doc("WooCommerce Integration Settings")
+		self.wc_server_cache: Dict[str, WooCommerceServer] = {}
+
+	def get_wc_server(self, name: str) -> WooCommerceServer:
+		"""
+		Get a WooCommerce Server, memoized for the lifetime of this synchronisation
+		"""
+		if name not in self.wc_server_cache:
+			self.wc_server_cache[name] = frappe.get_cached_doc("WooCommerce Server", name)
+		return self.wc_server_cache[name]
 
 	def run(self):
 		"""
@@ -199,18 +236,15 @@ class SynchroniseItem(SynchroniseWooCommerce):
 			self.item and not self.woocommerce_product and self.item.item_woocommerce_server.woocommerce_id
 		):
 			# Validate that this Item's WooCommerce Server has sync enabled
-			wc_server = frappe.get_cached_doc(
-				"WooCommerce Server", self.item.item_woocommerce_server.woocommerce_server
-			)
+			wc_server = self.get_wc_server(self.item.item_woocommerce_server.woocommerce_server)
 			if not wc_server.enable_sync:
 				raise SyncDisabledError(wc_server)
 
-			wc_products = get_list_of_wc_products(item=self.item)
-			if len(wc_products) == 0:
+			self.woocommerce_product = next(iter_wc_products(item=self.item), None)
+			if not self.woocommerce_product:
 				raise ValueError(
 					f"No WooCommerce Product found with ID {self.item.item_woocommerce_server.woocommerce_id} on {self.item.item_woocommerce_server.woocommerce_server}"
 				)
-			self.woocommerce_product = wc_products[0]
 
 		if self.woocommerce_product and not self.item:
 			self.get_erpnext_item()
@@ -244,18 +278,16 @@ class SynchroniseItem(SynchroniseWooCommerce):
 
 		found_item = frappe.get_doc("Item", item_codes[0].parent) if item_codes else None
 		if found_item:
+			idx_by_name = {server.name: server.idx for server in found_item.woocommerce_servers}
 			self.item = ERPNextItemToSync(
 				item=found_item,
-				item_woocommerce_server_idx=next(
-					server.idx for server in found_item.woocommerce_servers if server.name == item_codes[0].name
-				),
+				item_woocommerce_server_idx=idx_by_name[item_codes[0].name],
 			)
 
 	def sync_wc_product_with_erpnext_item(self):
 		"""
 		Syncronise Item between ERPNext and WooCommerce
 		"""
-		frappe.log_error(self.item)
 		if self.item and not self.woocommerce_product:
 			# create missing product in WooCommerce
 			self.create_woocommerce_product(self.item)
@@ -268,13 +300,11 @@ class SynchroniseItem(SynchroniseWooCommerce):
 				self.woocommerce_product.woocommerce_date_modified
 				!= self.item.item_woocommerce_server.woocommerce_last_sync_hash
 			):
-				if get_datetime(self.woocommerce_product.woocommerce_date_modified) > get_datetime(
-					self.item.item.modified
-				):
+				woocommerce_product_modified = get_datetime(self.woocommerce_product.woocommerce_date_modified)
+				item_modified = get_datetime(self.item.item.modified)
+				if woocommerce_product_modified > item_modified:
 					self.update_item(self.woocommerce_product, self.item)
-				if get_datetime(self.woocommerce_product.woocommerce_date_modified) < get_datetime(
-					self.item.item.modified
-				):
+				elif woocommerce_product_modified < item_modified:
 					self.update_woocommerce_product(self.woocommerce_product, self.item)
 
 	def update_item(self, woocommerce_product: WooCommerceProduct, item: ERPNextItemToSync):
@@ -328,10 +358,8 @@ class SynchroniseItem(SynchroniseWooCommerce):
 									)
 
 								if media_response and media_response.get("id"):
-									# frappe log the media response id
-									frappe.log_error(
-										message=f"WooCommerce Media Response: {media_response}, Media Response ID: {media_response.get('id')}",
-										title="WooCommerce Media Response",
+									frappe.logger("wc_sync").info(
+										f"WooCommerce Media Response ID: {media_response.get('id')}"
 									)
 									# Update the image in the WooCommerce product
 									new_image = {
@@ -384,16 +412,18 @@ class SynchroniseItem(SynchroniseWooCommerce):
 				wc_product.type = "variable"
 				wc_product_attributes = []
 
-				# Handle attributes
+				# Handle attributes, getting the values of all attributes with a single query
+				options_by_attribute = get_item_attribute_values(
+					[row.attribute for row in item.item.attributes]
+				)
 				for row in item.item.attributes:
-					item_attribute = frappe.get_doc("Item Attribute", row.attribute)
 					wc_product_attributes.append(
 						{
 							"name": row.attribute,
 							"slug": row.attribute.lower().replace(" ", "_"),
 							"visible": True,
 							"variation": True,
-							"options": [option.attribute_value for option in item_attribute.item_attribute_values],
+							"options": options_by_attribute.get(row.attribute, []),
 						}
 					)
 
@@ -401,8 +431,7 @@ class SynchroniseItem(SynchroniseWooCommerce):
 
 			if item.item.variant_of:
 				# Check if parent exists
-				parent_item = frappe.get_doc("Item", item.item.variant_of)
-				parent_item, parent_wc_product = run_item_sync(item_code=parent_item.item_code)
+				parent_item, parent_wc_product = run_item_sync(item_code=item.item.variant_of)
 				wc_product.parent_id = parent_wc_product.woocommerce_id
 				wc_product.type = "variation"
 
@@ -441,19 +470,25 @@ class SynchroniseItem(SynchroniseWooCommerce):
 			wc_product.insert()
 			self.woocommerce_product = wc_product
 
-			# Reload ERPNext Item
-			item.item.reload()
+			# Link the ERPNext Item to the new WooCommerce Product and set the last sync hash in a
+			# single update, instead of saving the whole Item
 			item.item_woocommerce_server.woocommerce_id = wc_product.woocommerce_id
-			item.item.flags.created_by_sync = True
-			item.item.save()
-
-			self.set_sync_hash()
+			frappe.db.set_value(
+				"Item WooCommerce Server",
+				item.item_woocommerce_server.name,
+				{
+					"woocommerce_id": wc_product.woocommerce_id,
+					"woocommerce_last_sync_hash": wc_product.woocommerce_date_modified,
+				},
+				update_modified=False,
+			)
+			frappe.clear_document_cache("Item", item.item.name)
 
 	def create_item(self, wc_product: WooCommerceProduct) -> None:
 		"""
 		Create an ERPNext Item from the given WooCommerce Product
 		"""
-		wc_server = frappe.get_cached_doc("WooCommerce Server", wc_product.woocommerce_server)
+		wc_server = self.get_wc_server(wc_product.woocommerce_server)
 
 		# Create Item
 		item = frappe.new_doc("Item")
@@ -497,13 +532,10 @@ class SynchroniseItem(SynchroniseWooCommerce):
 		item.flags.created_by_sync = True
 		item.insert()
 
+		idx_by_server = {iws.woocommerce_server: iws.idx for iws in item.woocommerce_servers}
 		self.item = ERPNextItemToSync(
 			item=item,
-			item_woocommerce_server_idx=next(
-				iws.idx
-				for iws in item.woocommerce_servers
-				if iws.woocommerce_server == wc_product.woocommerce_server
-			),
+			item_woocommerce_server_idx=idx_by_server[wc_product.woocommerce_server],
 		)
 
 		self.set_item_fields()
@@ -516,15 +548,24 @@ class SynchroniseItem(SynchroniseWooCommerce):
 		"""
 		if wc_product.attributes:
 			wc_attributes = json.loads(wc_product.attributes)
-			for wc_attribute in wc_attributes:
-				if frappe.db.exists("Item Attribute", wc_attribute["name"]):
-					# Get existing Item Attribute
-					item_attribute = frappe.get_doc("Item Attribute", wc_attribute["name"])
-				else:
-					# Create a Item Attribute
-					item_attribute = frappe.get_doc(
-						{"doctype": "Item Attribute", "attribute_name": wc_attribute["name"]}
+
+			# Get the existing Item Attributes and their values in bulk.
+			# Item Attribute names are matched case-insensitively, like the database does
+			attribute_names = [wc_attribute["name"] for wc_attribute in wc_attributes]
+			existing_attributes = (
+				{
+					name.casefold(): name
+					for name in frappe.get_all(
+						"Item Attribute", filters={"name": ["in", attribute_names]}, pluck="name"
 					)
+				}
+				if attribute_names
+				else {}
+			)
+			values_by_attribute = get_item_attribute_values(list(existing_attributes.values()))
+
+			for wc_attribute in wc_attributes:
+				existing_attribute_name = existing_attributes.get(wc_attribute["name"].casefold())
 
 				# Get list of attribute options.
 				# In variable WooCommerce Products, it's a list with key "options"
@@ -533,16 +574,27 @@ class SynchroniseItem(SynchroniseWooCommerce):
 					wc_attribute["options"] if wc_product.type == "variable" else [wc_attribute["option"]]
 				)
 
-				# If no attributes values exist, or attribute values exist already but are different, remove and update them
-				if len(item_attribute.item_attribute_values) == 0 or (
-					len(item_attribute.item_attribute_values) > 0
-					and set(options) != set([val.attribute_value for val in item_attribute.item_attribute_values])
-				):
-					item_attribute.item_attribute_values = []
-					for option in options:
-						row = item_attribute.append("item_attribute_values")
-						row.attribute_value = option
-						row.abbr = option.replace(" ", "")
+				# Skip existing Item Attributes that have the same attribute values already
+				existing_values = values_by_attribute.get(existing_attribute_name, [])
+				if existing_attribute_name and existing_values and set(options) == set(existing_values):
+					continue
+
+				if existing_attribute_name:
+					# Get existing Item Attribute
+					item_attribute = frappe.get_doc("Item Attribute", existing_attribute_name)
+				else:
+					# Create a Item Attribute
+					item_attribute = frappe.get_doc(
+						{"doctype": "Item Attribute", "attribute_name": wc_attribute["name"]}
+					)
+
+				# No attribute values exist, or attribute values exist already but are different,
+				# so remove and update them
+				item_attribute.item_attribute_values = []
+				for option in options:
+					row = item_attribute.append("item_attribute_values")
+					row.attribute_value = option
+					row.abbr = option.replace(" ", "")
 
 				item_attribute.flags.ignore_mandatory = True
 				if not item_attribute.name:
@@ -556,9 +608,7 @@ class SynchroniseItem(SynchroniseWooCommerce):
 		WooCommerce to ERPNext
 		"""
 		if self.item and self.woocommerce_product:
-			wc_server = frappe.get_cached_doc(
-				"WooCommerce Server", self.woocommerce_product.woocommerce_server
-			)
+			wc_server = self.get_wc_server(self.woocommerce_product.woocommerce_server)
 			if wc_server.item_field_map:
 				for map in wc_server.item_field_map:
 					erpnext_item_field_name = map.erpnext_field_name.split(" | ")
@@ -583,7 +633,7 @@ class SynchroniseItem(SynchroniseWooCommerce):
 		"""
 		wc_product_dirty = False
 		if item and woocommerce_product:
-			wc_server = frappe.get_cached_doc("WooCommerce Server", woocommerce_product.woocommerce_server)
+			wc_server = self.get_wc_server(woocommerce_product.woocommerce_server)
 			if wc_server.item_field_map:
 				for map in wc_server.item_field_map:
 					erpnext_item_field_name = map.erpnext_field_name.split(" | ")
@@ -614,9 +664,7 @@ class SynchroniseItem(SynchroniseWooCommerce):
 		"""
 		Handle media creation and deletion using WooCommerce API
 		"""
-		wc_server = frappe.get_cached_doc(
-			"WooCommerce Server", self.woocommerce_product.woocommerce_server
-		)
+		wc_server = self.get_wc_server(self.woocommerce_product.woocommerce_server)
 
 		if not wc_server or not wc_server.enable_sync:
 			return None
@@ -634,13 +682,7 @@ class SynchroniseItem(SynchroniseWooCommerce):
 			#     image_data = base64.b64encode(
 			#         response.content).decode('utf-8')
 
-		wc_api = APIWithRequestLogging(
-			url=wc_server.woocommerce_server_url,
-			consumer_key=wc_server.api_consumer_key,
-			consumer_secret=wc_server.api_consumer_secret,
-			version="wc/v3",
-			timeout=40,
-		)
+		wc_api = get_woocommerce_api(wc_server)
 
 		# Create new media
 		media_endpoint = "media"
@@ -678,21 +720,18 @@ class SynchroniseItem(SynchroniseWooCommerce):
 			raise err
 
 
-def get_list_of_wc_products(
+def iter_wc_products(
 	item: Optional[ERPNextItemToSync] = None, date_time_from: Optional[datetime] = None
-) -> List[WooCommerceProduct]:
+) -> Iterator[WooCommerceProduct]:
 	"""
-	Fetches a list of WooCommerce Products within a specified date range or linked with an Item, using pagination.
+	Fetches WooCommerce Products within a specified date range or linked with an Item, using pagination.
+
+	Products are fetched one page at a time, so that the full result set is never held in memory.
 	"""
 	if not any([date_time_from, item]):
 		raise ValueError("At least one of date_time_from or item parameters are required")
 
-	wc_records_per_page_limit = 100
-	page_length = wc_records_per_page_limit
-	new_results = True
-	start = 0
 	filters = []
-	wc_products = []
 	servers = None
 
 	# Build filters
@@ -705,21 +744,26 @@ def get_list_of_wc_products(
 		filters.append(["WooCommerce Product", "id", "=", item.item_woocommerce_server.woocommerce_id])
 		servers = [item.item_woocommerce_server.woocommerce_server]
 
-	woocommerce_product = frappe.get_doc({"doctype": "WooCommerce Product"})
-	new_results = woocommerce_product.get_list(
-		args={
-			"filters": filters,
-			"page_length": page_length,
-			"start": start,
-			"servers": servers,
-			"as_doc": True,
-		}
-	)
+	for record in WooCommerceProduct.iter_records(args={"filters": filters, "servers": servers}):
+		yield frappe.get_doc(record)
 
-	for wc_product in new_results:
-		wc_products.append(wc_product)
 
-	return wc_products
+def get_item_attribute_values(attribute_names: List[str]) -> Dict[str, List[str]]:
+	"""
+	Get the values of a list of Item Attributes with a single query, keyed by Item Attribute name
+	"""
+	values_by_attribute = defaultdict(list)
+	if attribute_names:
+		attribute_values = frappe.get_all(
+			"Item Attribute Value",
+			filters={"parenttype": "Item Attribute", "parent": ["in", attribute_names]},
+			fields=["parent", "attribute_value"],
+			order_by="idx asc",
+		)
+		for row in attribute_values:
+			values_by_attribute[row.parent].append(row.attribute_value)
+
+	return values_by_attribute
 
 
 def get_item_price_rate(item: ERPNextItemToSync):
@@ -731,19 +775,27 @@ def get_item_price_rate(item: ERPNextItemToSync):
 		"WooCommerce Server", item.item_woocommerce_server.woocommerce_server
 	)
 	if wc_server.enable_price_list_sync:
-		item_prices = frappe.get_all(
-			"Item Price",
-			filters={"item_code": item.item.item_name, "price_list": wc_server.price_list},
-			fields=["price_list_rate", "valid_upto"],
-		)
-		return next(
-			(
-				price.price_list_rate
-				for price in item_prices
-				if not price.valid_upto or price.valid_upto > now()
-			),
-			None,
-		)
+		return get_price_list_rate(item.item.item_code, wc_server.price_list)
+
+
+@request_cache
+def get_price_list_rate(item_code: str, price_list: str):
+	"""
+	Get the currently valid rate of an Item in a Price List, cached for the duration of the request
+	"""
+	item_prices = frappe.get_all(
+		"Item Price",
+		filters={"item_code": item_code, "price_list": price_list},
+		fields=["price_list_rate", "valid_upto"],
+	)
+	return next(
+		(
+			price.price_list_rate
+			for price in item_prices
+			if not price.valid_upto or getdate(price.valid_upto) >= getdate()
+		),
+		None,
+	)
 
 
 def clear_sync_hash_and_run_item_sync(item_code: str):
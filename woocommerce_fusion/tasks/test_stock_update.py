@@ -5,8 +5,14 @@ from frappe import _dict
 from frappe.tests.utils import FrappeTestCase
 
 from woocommerce_fusion.tasks.stock_update import (
+	process_stock_level_batch_responses,
 	update_stock_levels_for_all_enabled_items_in_background,
+	update_stock_levels_for_woocommerce_item,
 	update_stock_levels_on_woocommerce_site,
+	update_stock_levels_on_woocommerce_site_bulk,
+)
+from woocommerce_fusion.woocommerce.doctype.item_woocommerce_server.item_woocommerce_server import (
+	ItemWooCommerceServer,
 )
 
 
@@ -16,10 +22,65 @@ class TestWooCommerceStockSync(FrappeTestCase):
 		super().setUpClass()  # important to call super() methods when extending TestCase.
 
 	@patch("woocommerce_fusion.tasks.stock_update.frappe")
-	@patch("woocommerce_fusion.tasks.stock_update.APIWithRequestLogging", autospec=True)
+	def test_update_stock_levels_for_woocommerce_item_enqueues_unique_item_codes(self, mock_frappe):
+		mock_frappe.flags.in_test = False
+		mock_frappe.get_list.return_value = [frappe._dict(name="woo1.example.com")]
+		mock_frappe.get_all.return_value = ["item_a", "item_b", "item_a"]
+
+		# Set up a dummy Delivery Note with the same item on multiple lines
+		doc = frappe._dict(
+			doctype="Delivery Note",
+			items=[
+				frappe._dict(item_code="item_a"),
+				frappe._dict(item_code="item_b"),
+				frappe._dict(item_code="item_a"),
+			],
+		)
+
+		# Call function under test
+		update_stock_levels_for_woocommerce_item(doc, "on_submit")
+
+		# Assert that a single job was enqueued, with each item code only once
+		mock_frappe.enqueue.assert_called_once_with(
+			"woocommerce_fusion.tasks.stock_update.update_stock_levels_on_woocommerce_site_bulk",
+			enqueue_after_commit=True,
+			item_codes=["item_a", "item_b"],
+		)
+
+	@patch("woocommerce_fusion.tasks.stock_update.frappe")
+	def test_update_stock_levels_for_woocommerce_item_skips_unlinked_items(self, mock_frappe):
+		mock_frappe.flags.in_test = False
+		mock_frappe.get_list.return_value = [frappe._dict(name="woo1.example.com")]
+		mock_frappe.get_all.return_value = ["item_b"]
+
+		# Set up a dummy Stock Entry with an item that isn't linked to WooCommerce
+		doc = frappe._dict(
+			doctype="Stock Entry",
+			items=[frappe._dict(item_code="item_a"), frappe._dict(item_code="item_b")],
+		)
+
+		# Call function under test
+		update_stock_levels_for_woocommerce_item(doc, "on_submit")
+
+		# Assert that a job was enqueued for the linked item only
+		mock_frappe.enqueue.assert_called_once_with(
+			"woocommerce_fusion.tasks.stock_update.update_stock_levels_on_woocommerce_site_bulk",
+			enqueue_after_commit=True,
+			item_codes=["item_b"],
+		)
+
+		# Assert that no job is enqueued if none of the items are linked to WooCommerce
+		mock_frappe.enqueue.reset_mock()
+		mock_frappe.get_all.return_value = []
+		update_stock_levels_for_woocommerce_item(doc, "on_submit")
+		mock_frappe.enqueue.assert_not_called()
+
+	@patch("woocommerce_fusion.tasks.stock_update.frappe")
+	@patch("woocommerce_fusion.tasks.stock_update.get_woocommerce_api")
 	def test_update_stock_levels_on_woocommerce_site(self, mock_wc_api, mock_frappe):
 		# Set up a dummy item set to sync to two different WC sites
 		some_item = frappe._dict(
+			name="some_item_code",
 			woocommerce_servers=[
 				frappe._dict(woocommerce_id=1, woocommerce_server="woo1.example.com", enabled=1),
 				frappe._dict(woocommerce_id=2, woocommerce_server="woo2.example.com", enabled=1),
@@ -27,18 +88,18 @@ class TestWooCommerceStockSync(FrappeTestCase):
 			is_stock_item=1,
 			disabled=0,
 		)
-		mock_frappe.get_doc.return_value = some_item
 
-		# Set up a dummy bin list with stock in two Warehouses
-		bin_list = [
-			frappe._dict(warehouse="Warehouse A", actual_qty=5),
-			frappe._dict(warehouse="Warehouse B", actual_qty=10),
-			frappe._dict(warehouse="Warehouse C", actual_qty=20),
+		# Set up dummy stock levels, summed over the two Warehouses of each WC site
+		stock_levels = [frappe._dict(item_code="some_item_code", actual_qty=15)]
+		mock_frappe.get_all.side_effect = [
+			[frappe._dict(name="woo1.example.com"), frappe._dict(name="woo2.example.com")],
+			stock_levels,
+			stock_levels,
 		]
-		mock_frappe.get_list.return_value = bin_list
 
 		# Set up mock return values
 		mock_frappe.get_cached_doc.side_effect = [
+			some_item,
 			frappe._dict(
 				woocommerce_server="woo1.example.com",
 				enable_sync=1,
@@ -70,11 +131,317 @@ class TestWooCommerceStockSync(FrappeTestCase):
 		actual_put_data = [call.kwargs["data"] for call in mock_api_instance.put.call_args_list]
 
 		expected_put_endpoints = ["products/1", "products/2"]
-		expected_data = {"stock_quantity": 15}
+		expected_data = {"manage_stock": True, "stock_quantity": 15}
 		expected_put_data = [expected_data for x in range(2)]
 		self.assertEqual(actual_put_endpoints, expected_put_endpoints)
 		self.assertEqual(actual_put_data, expected_put_data)
 
+	@patch("woocommerce_fusion.tasks.stock_update.frappe")
+	@patch("woocommerce_fusion.tasks.stock_update.get_woocommerce_api")
+	def test_update_stock_levels_on_woocommerce_site_bulk(self, mock_wc_api, mock_frappe):
+		# Set up two dummy items, each set to sync to a WC site
+		item_a = frappe._dict(
+			name="item_a",
+			woocommerce_servers=[
+				frappe._dict(woocommerce_id=1, woocommerce_server="woo1.example.com", enabled=1)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+		item_b = frappe._dict(
+			name="item_b",
+			woocommerce_servers=[
+				frappe._dict(woocommerce_id=2, woocommerce_server="woo1.example.com", enabled=1)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+
+		# Set up dummy stock levels for both items
+		mock_frappe.get_all.side_effect = [
+			[frappe._dict(name="woo1.example.com")],
+			[
+				frappe._dict(item_code="item_a", actual_qty=15),
+				frappe._dict(item_code="item_b", actual_qty=7),
+			],
+		]
+
+		wc_server = frappe._dict(
+			woocommerce_server="woo1.example.com",
+			enable_sync=1,
+			enable_stock_level_synchronisation=1,
+			warehouses=[frappe._dict(warehouse="Warehouse A"), frappe._dict(warehouse="Warehouse B")],
+		)
+		mock_frappe.get_cached_doc.side_effect = [wc_server, item_a, item_b]
+
+		# Mock out calls to WooCommerce API's
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {"update": [{"id": 1}, {"id": 2}]}
+
+		mock_api_instance = MagicMock()
+		mock_api_instance.post.return_value = mock_post_response
+		mock_wc_api.return_value = mock_api_instance
+
+		# Call function under test
+		update_stock_levels_on_woocommerce_site_bulk(["item_a", "item_b"])
+
+		# Assert that the WooCommerce Servers and the stock levels were each fetched once for all items
+		self.assertEqual(mock_frappe.get_all.call_count, 2)
+		self.assertEqual(
+			mock_frappe.get_all.call_args.kwargs["filters"],
+			{
+				"item_code": ["in", ["item_a", "item_b"]],
+				"warehouse": ["in", ["Warehouse A", "Warehouse B"]],
+			},
+		)
+
+		# Assert that both products were updated with a single batch request
+		mock_api_instance.post.assert_called_once_with(
+			"products/batch",
+			data={
+				"update": [
+					{"id": 1, "manage_stock": True, "stock_quantity": 15},
+					{"id": 2, "manage_stock": True, "stock_quantity": 7},
+				]
+			},
+		)
+		mock_api_instance.put.assert_not_called()
+
+	@patch("woocommerce_fusion.tasks.stock_update.frappe")
+	@patch("woocommerce_fusion.tasks.stock_update.get_woocommerce_api")
+	def test_update_stock_levels_on_woocommerce_site_bulk_skips_unchanged_stock_levels(
+		self, mock_wc_api, mock_frappe
+	):
+		# Set up two dummy items, of which the first one's stock level was posted already
+		item_a = frappe._dict(
+			name="item_a",
+			woocommerce_servers=[
+				frappe._dict(
+					woocommerce_id=1,
+					woocommerce_server="woo1.example.com",
+					enabled=1,
+					woocommerce_last_pushed_stock="15",
+				)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+		item_b = frappe._dict(
+			name="item_b",
+			woocommerce_servers=[
+				frappe._dict(
+					woocommerce_id=2,
+					woocommerce_server="woo1.example.com",
+					enabled=1,
+					woocommerce_last_pushed_stock="5",
+				)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+
+		mock_frappe.get_all.side_effect = [
+			[frappe._dict(name="woo1.example.com")],
+			[
+				frappe._dict(item_code="item_a", actual_qty=15),
+				frappe._dict(item_code="item_b", actual_qty=7),
+			],
+		]
+		wc_server = frappe._dict(
+			woocommerce_server="woo1.example.com",
+			enable_sync=1,
+			enable_stock_level_synchronisation=1,
+			warehouses=[frappe._dict(warehouse="Warehouse A")],
+		)
+		mock_frappe.get_cached_doc.side_effect = [wc_server, item_a, item_b]
+
+		# Mock out calls to WooCommerce API's
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {"update": [{"id": 2}]}
+
+		mock_api_instance = MagicMock()
+		mock_api_instance.post.return_value = mock_post_response
+		mock_wc_api.return_value = mock_api_instance
+
+		# Call function under test
+		update_stock_levels_on_woocommerce_site_bulk(["item_a", "item_b"])
+
+		# Assert that only the product with a changed stock level was posted
+		mock_api_instance.post.assert_called_once_with(
+			"products/batch",
+			data={"update": [{"id": 2, "manage_stock": True, "stock_quantity": 7}]},
+		)
+
+	@patch("woocommerce_fusion.tasks.stock_update.frappe")
+	@patch("woocommerce_fusion.tasks.stock_update.get_woocommerce_api")
+	def test_update_stock_levels_on_woocommerce_site_bulk_raises_if_a_server_failed(
+		self, mock_wc_api, mock_frappe
+	):
+		# Set up two dummy items, each set to sync to a different WC site
+		item_a = frappe._dict(
+			name="item_a",
+			woocommerce_servers=[
+				frappe._dict(woocommerce_id=1, woocommerce_server="woo1.example.com", enabled=1)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+		item_b = frappe._dict(
+			name="item_b",
+			woocommerce_servers=[
+				frappe._dict(woocommerce_id=2, woocommerce_server="woo2.example.com", enabled=1)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+
+		mock_frappe.get_all.side_effect = [
+			[frappe._dict(name="woo1.example.com"), frappe._dict(name="woo2.example.com")],
+			[frappe._dict(item_code="item_a", actual_qty=15)],
+			[frappe._dict(item_code="item_b", actual_qty=7)],
+		]
+		wc_server_1 = frappe._dict(
+			woocommerce_server="woo1.example.com",
+			enable_sync=1,
+			enable_stock_level_synchronisation=1,
+			warehouses=[frappe._dict(warehouse="Warehouse A")],
+		)
+		wc_server_2 = frappe._dict(
+			woocommerce_server="woo2.example.com",
+			enable_sync=1,
+			enable_stock_level_synchronisation=1,
+			warehouses=[frappe._dict(warehouse="Warehouse A")],
+		)
+		mock_frappe.get_cached_doc.side_effect = [wc_server_1, wc_server_2, item_a, item_b]
+
+		# Mock out calls to WooCommerce API's, with the first WC site failing
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {"update": [{"id": 2}]}
+
+		mock_failing_api_instance = MagicMock()
+		mock_failing_api_instance.post.side_effect = ConnectionError()
+		mock_api_instance = MagicMock()
+		mock_api_instance.post.return_value = mock_post_response
+		mock_wc_api.side_effect = [mock_failing_api_instance, mock_api_instance]
+
+		# Call function under test
+		with self.assertRaises(ValueError):
+			update_stock_levels_on_woocommerce_site_bulk(["item_a", "item_b"])
+
+		# Assert that the other WC site was still updated, and that the failure was logged
+		mock_api_instance.post.assert_called_once_with(
+			"products/batch",
+			data={"update": [{"id": 2, "manage_stock": True, "stock_quantity": 7}]},
+		)
+		mock_frappe.log_error.assert_called_once()
+
+	@patch("woocommerce_fusion.tasks.stock_update.frappe")
+	@patch("woocommerce_fusion.tasks.stock_update.get_woocommerce_api")
+	def test_update_stock_levels_on_woocommerce_site_bulk_logs_failed_retries_once(
+		self, mock_wc_api, mock_frappe
+	):
+		# Set up a dummy item, set to sync to a WC site
+		item_a = frappe._dict(
+			name="item_a",
+			woocommerce_servers=[
+				frappe._dict(woocommerce_id=1, woocommerce_server="woo1.example.com", enabled=1)
+			],
+			is_stock_item=1,
+			disabled=0,
+		)
+		mock_frappe.get_all.side_effect = [
+			[frappe._dict(name="woo1.example.com")],
+			[frappe._dict(item_code="item_a", actual_qty=15)],
+		]
+		wc_server = frappe._dict(
+			woocommerce_server="woo1.example.com",
+			enable_sync=1,
+			enable_stock_level_synchronisation=1,
+			warehouses=[frappe._dict(warehouse="Warehouse A")],
+		)
+		mock_frappe.get_cached_doc.side_effect = [wc_server, item_a]
+
+		# Mock out calls to WooCommerce API's, with the product failing in the batch and on retry
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {
+			"update": [{"id": 1, "error": {"code": "woocommerce_rest_product_invalid_id"}}]
+		}
+		mock_put_response = Mock()
+		mock_put_response.raise_for_status.side_effect = ConnectionError()
+
+		mock_api_instance = MagicMock()
+		mock_api_instance.post.return_value = mock_post_response
+		mock_api_instance.put.return_value = mock_put_response
+		mock_wc_api.return_value = mock_api_instance
+
+		# Call function under test
+		with self.assertRaises(ValueError):
+			update_stock_levels_on_woocommerce_site_bulk(["item_a"])
+
+		# Assert that the failure was logged exactly once
+		mock_frappe.log_error.assert_called_once()
+
+	def test_item_woocommerce_server_clears_last_pushed_stock_when_relinked(self):
+		# Set up a row of which the stock level was posted to WooCommerce Product 3
+		row = ItemWooCommerceServer(
+			{
+				"doctype": "Item WooCommerce Server",
+				"name": "row1",
+				"parentfield": "woocommerce_servers",
+				"woocommerce_id": "3",
+				"woocommerce_server": "woo1.example.com",
+				"woocommerce_last_pushed_stock": "7",
+			}
+		)
+		row.parent_doc = Mock()
+		row.parent_doc.get_doc_before_save.return_value = frappe._dict(
+			woocommerce_servers=[
+				frappe._dict(name="row1", woocommerce_id="3", woocommerce_server="woo1.example.com")
+			]
+		)
+
+		# Assert that the last pushed stock level is kept if the link did not change
+		row.validate()
+		self.assertEqual(row.woocommerce_last_pushed_stock, "7")
+
+		# Assert that the last pushed stock level is cleared if the row is linked to another product
+		row.woocommerce_id = "4"
+		row.validate()
+		self.assertIsNone(row.woocommerce_last_pushed_stock)
+
+	def test_process_stock_level_batch_responses_retries_failed_products(self):
+		# Mock out calls to WooCommerce API's, with the second product failing in the batch
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {
+			"update": [{"id": 1}, {"id": 2, "error": {"code": "woocommerce_rest_product_invalid_id"}}]
+		}
+		mock_put_response = Mock()
+		mock_put_response.status_code = 200
+
+		mock_api_instance = MagicMock()
+		mock_api_instance.put.return_value = mock_put_response
+
+		# Call function under test
+		updates = [
+			(frappe._dict(name="row1"), {"id": 1, "manage_stock": True, "stock_quantity": 15}),
+			(frappe._dict(name="row2"), {"id": 2, "manage_stock": True, "stock_quantity": 7}),
+		]
+		with patch("woocommerce_fusion.tasks.stock_update.set_last_pushed_stock_level") as mock_set:
+			process_stock_level_batch_responses(mock_api_instance, [(updates, mock_post_response)])
+
+		# Assert that only the failed product was retried with a PUT request
+		mock_api_instance.put.assert_called_once_with(
+			endpoint="products/2", data={"manage_stock": True, "stock_quantity": 7}
+		)
+
+		# Assert that the posted stock levels were stored for both products
+		self.assertEqual(mock_set.call_count, 2)
+
 	@patch("woocommerce_fusion.tasks.stock_update.frappe.db.get_all")
 	@patch("woocommerce_fusion.tasks.stock_update.frappe.enqueue")
 	def test_update_stock_levels_for_all_enabled_items_in_background(
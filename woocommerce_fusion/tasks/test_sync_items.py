@@ -1,10 +1,22 @@
-from unittest.mock import MagicMock, Mock, call, patch
+from unittest.mock import MagicMock, Mock, patch
 
 import frappe
 from frappe.tests.utils import FrappeTestCase
-
-from woocommerce_fusion.tasks.sync_items import ERPNextItemToSync, SynchroniseItem
+from frappe.utils import add_days, getdate, today
+
+from woocommerce_fusion.tasks.sync_items import (
+	ERPNextItemToSync,
+	SynchroniseItem,
+	get_price_list_rate,
+	iter_wc_products,
+	run_item_sync_bulk,
+	sync_woocommerce_products_modified_since,
+)
+from woocommerce_fusion.woocommerce.doctype.woocommerce_product.woocommerce_product import (
+	WooCommerceProduct,
+)
 from woocommerce_fusion.woocommerce.woocommerce_api import (
+	WooCommerceAPI,
 	generate_woocommerce_record_name_from_domain_and_id,
 )
 
@@ -232,6 +244,8 @@ class TestWooCommerceSync(FrappeTestCase):
 		# Assert that ERPNext template item is created
 		self.assertEqual(item_mock.has_variants, 1)
 
+	@patch("frappe.clear_document_cache")
+	@patch("frappe.db.set_value")
 	@patch("frappe.get_cached_doc")
 	@patch("frappe.get_doc")
 	@patch("woocommerce_fusion.tasks.sync_items.get_item_price_rate")
@@ -240,6 +254,8 @@ class TestWooCommerceSync(FrappeTestCase):
 		mock_get_item_price_rate,
 		mock_get_doc,
 		mock_get_cached_doc,
+		mock_set_value,
+		mock_clear_document_cache,
 		mock_set_sync_hash,
 		mock_run_item_sync,
 	):
@@ -281,8 +297,21 @@ class TestWooCommerceSync(FrappeTestCase):
 		self.assertEqual(wc_product_mock.regular_price, "100.00")
 
 		self.assertEqual(item_woocommerce_server_mock.woocommerce_id, wc_product_mock.woocommerce_id)
-		item_mock.item.save.assert_called_once()
+		mock_set_value.assert_called_once_with(
+			"Item WooCommerce Server",
+			item_woocommerce_server_mock.name,
+			{
+				"woocommerce_id": wc_product_mock.woocommerce_id,
+				"woocommerce_last_sync_hash": wc_product_mock.woocommerce_date_modified,
+			},
+			update_modified=False,
+		)
+		mock_clear_document_cache.assert_called_once_with("Item", item_mock.item.name)
+		item_mock.item.save.assert_not_called()
+		mock_set_sync_hash.assert_not_called()
 
+	@patch("frappe.clear_document_cache")
+	@patch("frappe.db.set_value")
 	@patch("frappe.get_cached_doc")
 	@patch("frappe.get_doc")
 	@patch("woocommerce_fusion.tasks.sync_items.get_item_price_rate")
@@ -291,6 +320,8 @@ class TestWooCommerceSync(FrappeTestCase):
 		mock_get_item_price_rate,
 		mock_get_doc,
 		mock_get_cached_doc,
+		mock_set_value,
+		mock_clear_document_cache,
 		mock_set_sync_hash,
 		mock_run_item_sync,
 	):
@@ -300,7 +331,8 @@ class TestWooCommerceSync(FrappeTestCase):
 		parent_item_mock = MagicMock()
 		parent_item_mock.woocommerce_id = 696969
 
-		mock_get_doc.side_effect = [wc_product_mock, parent_item_mock]
+		mock_get_doc.return_value = wc_product_mock
+		mock_get_cached_doc.return_value = parent_item_mock
 
 		mock_get_item_price_rate.return_value = "100.00"
 
@@ -325,15 +357,18 @@ class TestWooCommerceSync(FrappeTestCase):
 		sync.create_woocommerce_product(item_mock)
 
 		# Assertions
-		expected_calls = [call({"doctype": "WooCommerce Product"}), call("Item", "696969")]
-		mock_get_doc.assert_has_calls(expected_calls)
+		mock_get_doc.assert_called_once_with({"doctype": "WooCommerce Product"})
+		mock_run_item_sync.assert_called_once_with(item_code="696969")
 
 		wc_product_mock.insert.assert_called_once()
 
 		self.assertEqual(wc_product_mock.parent_id, 696969)
 		self.assertEqual(wc_product_mock.type, "variation")
-		item_mock.item.save.assert_called_once()
+		mock_set_value.assert_called_once()
+		item_mock.item.save.assert_not_called()
 
+	@patch("frappe.clear_document_cache")
+	@patch("frappe.db.set_value")
 	@patch("frappe.get_cached_doc")
 	@patch("frappe.get_doc")
 	@patch("woocommerce_fusion.tasks.sync_items.get_item_price_rate")
@@ -342,6 +377,8 @@ class TestWooCommerceSync(FrappeTestCase):
 		mock_get_item_price_rate,
 		mock_get_doc,
 		mock_get_cached_doc,
+		mock_set_value,
+		mock_clear_document_cache,
 		mock_set_sync_hash,
 		mock_run_item_sync,
 	):
@@ -378,4 +415,178 @@ class TestWooCommerceSync(FrappeTestCase):
 		wc_product_mock.insert.assert_called_once()
 
 		self.assertEqual(wc_product_mock.type, "variable")
-		item_mock.item.save.assert_called_once()
+		mock_set_value.assert_called_once()
+		item_mock.item.save.assert_not_called()
+
+	@patch("frappe.get_cached_doc")
+	def test_get_wc_server_is_memoized(
+		self, mock_get_cached_doc, mock_set_sync_hash, mock_run_item_sync
+	):
+		# Create instance of the class that contains get_wc_server method
+		sync = SynchroniseItem(servers=Mock())
+		mock_get_cached_doc.reset_mock()
+
+		# Get the same WooCommerce Server twice
+		first = sync.get_wc_server("Test Server")
+		second = sync.get_wc_server("Test Server")
+
+		# Assert that the WooCommerce Server was only loaded once
+		mock_get_cached_doc.assert_called_once_with("WooCommerce Server", "Test Server")
+		self.assertIs(first, second)
+
+	@patch("woocommerce_fusion.tasks.sync_items.iter_wc_products")
+	@patch("woocommerce_fusion.tasks.sync_items.frappe")
+	def test_sync_woocommerce_products_modified_since_enqueues_chunks(
+		self, mock_frappe, mock_iter_wc_products, mock_set_sync_hash, mock_run_item_sync
+	):
+		wc_products = [frappe._dict(name=f"site1.example.com~{x}") for x in range(60)]
+		mock_iter_wc_products.return_value = iter(wc_products)
+
+		# Call the function under test
+		sync_woocommerce_products_modified_since(date_time_from="2023-01-01")
+
+		# Assert that one job was enqueued per chunk of WooCommerce Products
+		self.assertEqual(mock_frappe.enqueue.call_count, 3)
+		enqueued_products = [
+			call.kwargs["woocommerce_products"] for call in mock_frappe.enqueue.call_args_list
+		]
+		self.assertEqual([len(products) for products in enqueued_products], [25, 25, 10])
+		self.assertEqual(sum(enqueued_products, []), wc_products)
+		for call in mock_frappe.enqueue.call_args_list:
+			self.assertEqual(call.kwargs["queue"], "long")
+		mock_run_item_sync.assert_not_called()
+
+	@patch("woocommerce_fusion.tasks.sync_items.frappe")
+	def test_create_or_update_item_attributes_skips_unchanged_attributes(
+		self, mock_frappe, mock_set_sync_hash, mock_run_item_sync
+	):
+		# Set up an existing "Colour" Item Attribute with the same values as on WooCommerce
+		mock_frappe.get_all.side_effect = [
+			["Colour"],
+			[
+				frappe._dict(parent="Colour", attribute_value="Red"),
+				frappe._dict(parent="Colour", attribute_value="Blue"),
+			],
+		]
+		new_item_attribute = MagicMock()
+		new_item_attribute.name = None
+		mock_frappe.get_doc.return_value = new_item_attribute
+
+		# Create a mock WooCommerceProduct with an existing and a new attribute
+		wc_product = MagicMock()
+		wc_product.type = "variable"
+		wc_product.attributes = (
+			'[{"name": "colour", "options": ["Blue", "Red"]}, {"name": "Size", "options": ["S"]}]'
+		)
+
+		# Create instance of the class that contains create_or_update_item_attributes method
+		sync = SynchroniseItem(servers=Mock())
+
+		# Call the method under test
+		sync.create_or_update_item_attributes(wc_product)
+
+		# Assert that only the new Item Attribute was created
+		mock_frappe.get_doc.assert_called_once_with({"doctype": "Item Attribute", "attribute_name": "Size"})
+		new_item_attribute.insert.assert_called_once()
+		self.assertEqual(mock_frappe.get_all.call_count, 2)
+
+	@patch.object(WooCommerceProduct, "_init_api")
+	@patch("woocommerce_fusion.tasks.sync_items.frappe")
+	def test_iter_wc_products_paginates(
+		self, mock_frappe, mock_init_api, mock_set_sync_hash, mock_run_item_sync
+	):
+		def wc_record(id, type="simple"):
+			return {
+				"id": id,
+				"type": type,
+				"date_created": "2023-01-01T00:00:00",
+				"date_created_gmt": "2023-01-01T00:00:00",
+				"date_modified": "2023-01-02T00:00:00",
+				"date_modified_gmt": "2023-01-02T00:00:00",
+			}
+
+		# Set up two pages of WooCommerce Products, with a variable product on the second page
+		pages = {
+			("products", 0): [wc_record(id) for id in range(1, 101)],
+			("products", 100): [wc_record(101, type="variable"), wc_record(102)],
+			("products/101/variations", 0): [wc_record(201), wc_record(202)],
+		}
+
+		def get(endpoint, params):
+			response = Mock(status_code=200)
+			response.json.return_value = pages.get((endpoint, params["offset"]), [])
+			return response
+
+		mock_api = MagicMock()
+		mock_api.get.side_effect = get
+		mock_init_api.return_value = [
+			WooCommerceAPI(
+				api=mock_api,
+				woocommerce_server_url="https://site1.example.com",
+				woocommerce_server="site1.example.com",
+			)
+		]
+		mock_frappe.get_doc.side_effect = lambda record: record
+
+		# Call the function under test
+		wc_products = list(iter_wc_products(date_time_from="2023-01-01"))
+
+		# Assert that all products were fetched, including the variants of the product on page 2
+		self.assertEqual(
+			[product["id"] for product in wc_products], list(range(1, 102)) + [201, 202, 102]
+		)
+
+		# Assert that each page was requested once, directly at its offset
+		requests = [
+			(call.args[0], call.kwargs["params"]["offset"]) for call in mock_api.get.call_args_list
+		]
+		self.assertEqual(
+			requests, [("products", 0), ("products", 100), ("products/101/variations", 0)]
+		)
+
+	@patch("woocommerce_fusion.tasks.sync_items.frappe")
+	def test_get_price_list_rate_skips_expired_prices(
+		self, mock_frappe, mock_set_sync_hash, mock_run_item_sync
+	):
+		# Set up an expired Item Price and an Item Price that expires today
+		mock_frappe.get_all.return_value = [
+			frappe._dict(price_list_rate=10, valid_upto=add_days(today(), -1)),
+			frappe._dict(price_list_rate=20, valid_upto=getdate()),
+		]
+
+		# Call the function under test
+		rate = get_price_list_rate("ITEM-PRICE-001", "Standard Selling")
+
+		# Assert that the Item Price that expires today is used
+		self.assertEqual(rate, 20)
+
+		# Assert that the Item Prices were filtered on item_code
+		self.assertEqual(
+			mock_frappe.get_all.call_args.kwargs["filters"],
+			{"item_code": "ITEM-PRICE-001", "price_list": "Standard Selling"},
+		)
+
+		# Assert that no rate is returned if all Item Prices have expired
+		mock_frappe.get_all.return_value = [
+			frappe._dict(price_list_rate=10, valid_upto=add_days(today(), -1)),
+		]
+		self.assertIsNone(get_price_list_rate("ITEM-PRICE-002", "Standard Selling"))
+
+	@patch("woocommerce_fusion.tasks.sync_items.frappe")
+	def test_run_item_sync_bulk_rolls_back_failed_products(
+		self, mock_frappe, mock_set_sync_hash, mock_run_item_sync
+	):
+		# Set up three WooCommerce Products, of which the second one fails to synchronise
+		wc_products = [frappe._dict(name=f"site1.example.com~{x}") for x in range(3)]
+		mock_run_item_sync.side_effect = [None, ValueError(), None]
+
+		# Call the function under test
+		run_item_sync_bulk(wc_products)
+
+		# Assert that all products were synchronised, each within its own savepoint
+		self.assertEqual(mock_run_item_sync.call_count, 3)
+		self.assertEqual(mock_frappe.db.savepoint.call_count, 3)
+
+		# Assert that only the failed product's changes were rolled back, and that its error was logged
+		mock_frappe.db.rollback.assert_called_once_with(save_point="run_item_sync")
+		mock_frappe.log_error.assert_called_once()
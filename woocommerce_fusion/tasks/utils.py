@@ -1,18 +1,32 @@
 import traceback
+from json import dumps as jsonencode
+from typing import Dict, Tuple
+from urllib.parse import urlencode
 
 import frappe
 import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
 from woocommerce import API
 
 
 class APIWithRequestLogging(API):
 	"""WooCommerce API with Request Logging."""
 
+	def __init__(self, url, consumer_key, consumer_secret, **kwargs):
+		super().__init__(url, consumer_key, consumer_secret, **kwargs)
+
+		# Use a persistent session, so that consecutive requests to the same server reuse the connection
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+		self.session.mount("https://", adapter)
+		self.session.mount("http://", adapter)
+
 	def _API__request(self, method, endpoint, data, params=None, **kwargs):
 		"""Override _request method to also create a 'WooCommerce Request Log'"""
 		result = None
 		try:
-			result = super()._API__request(method, endpoint, data, params, **kwargs)
+			result = self._send_request(method, endpoint, data, params, **kwargs)
 			if not frappe.flags.in_test:
 				frappe.enqueue(
 					"woocommerce_fusion.tasks.utils.log_woocommerce_request",
@@ -39,6 +53,70 @@ class APIWithRequestLogging(API):
 				)
 			raise e
 
+	def _send_request(self, method, endpoint, data, params=None, **kwargs):
+		"""
+		Same as API.__request, but sends the request using this instance's persistent session
+		instead of opening a new connection for every request
+
+		Copied from woocommerce 3.0.0 (woocommerce/api.py, API.__request), which is why the
+		dependency is pinned to that exact version. Keep this in sync when upgrading it.
+		"""
+		if params is None:
+			params = {}
+		url = self._API__get_url(endpoint)
+		auth = None
+		headers = {"user-agent": f"{self.user_agent}", "accept": "application/json"}
+
+		if self.is_ssl is True and self.query_string_auth is False:
+			auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+		elif self.is_ssl is True and self.query_string_auth is True:
+			params.update({"consumer_key": self.consumer_key, "consumer_secret": self.consumer_secret})
+		else:
+			encoded_params = urlencode(params)
+			url = f"{url}?{encoded_params}"
+			url = self._API__get_oauth_url(url, method, **kwargs)
+
+		if data is not None:
+			data = jsonencode(data, ensure_ascii=False).encode("utf-8")
+			headers["content-type"] = "application/json;charset=utf-8"
+
+		return self.session.request(
+			method=method,
+			url=url,
+			verify=self.verify_ssl,
+			auth=auth,
+			params=params,
+			data=data,
+			timeout=self.timeout,
+			headers=headers,
+			**kwargs,
+		)
+
+
+# WooCommerce API instances are kept for the lifetime of the worker, so that sessions are reused
+_WC_API_CACHE: Dict[Tuple[str, str, str], APIWithRequestLogging] = {}
+
+
+def get_woocommerce_api(wc_server) -> APIWithRequestLogging:
+	"""
+	Get a (cached) WooCommerce API instance for a WooCommerce Server
+	"""
+	key = (
+		wc_server.woocommerce_server_url,
+		wc_server.api_consumer_key,
+		wc_server.api_consumer_secret,
+	)
+	if key not in _WC_API_CACHE:
+		_WC_API_CACHE[key] = APIWithRequestLogging(
+			url=wc_server.woocommerce_server_url,
+			consumer_key=wc_server.api_consumer_key,
+			consumer_secret=wc_server.api_consumer_secret,
+			version="wc/v3",
+			timeout=40,
+		)
+
+	return _WC_API_CACHE[key]
+
 
 def log_woocommerce_request(
 	url: str,
@@ -6,4 +6,33 @@ from frappe.model.document import Document
 
 
 class ItemWooCommerceServer(Document):
-	pass
+	def validate(self):
+		self.clear_last_pushed_stock_if_relinked()
+
+	def clear_last_pushed_stock_if_relinked(self):
+		"""
+		Clear the last pushed stock level if this row is linked to another WooCommerce Product, so that
+		the stock level of the newly linked product is not skipped
+		"""
+		parent_doc = getattr(self, "parent_doc", None)
+		doc_before_save = parent_doc.get_doc_before_save() if parent_doc else None
+		if not doc_before_save:
+			return
+
+		row_before_save = next(
+			(row for row in doc_before_save.get(self.parentfield) or [] if row.name == self.name), None
+		)
+		if row_before_save and (
+			row_before_save.woocommerce_id != self.woocommerce_id
+			or row_before_save.woocommerce_server != self.woocommerce_server
+		):
+			self.woocommerce_last_pushed_stock = None
+
+
+def validate_item_woocommerce_servers(doc, method):
+	"""
+	Intended to be triggered by a Document Controller hook from Item, as the controllers of child
+	table rows are not run when their parent is saved
+	"""
+	for row in doc.get("woocommerce_servers") or []:
+		row.validate()
@@ -8,7 +8,7 @@ from typing import Dict, List
 
 import frappe
 
-from woocommerce_fusion.tasks.utils import APIWithRequestLogging
+from woocommerce_fusion.tasks.utils import get_woocommerce_api
 from woocommerce_fusion.woocommerce.woocommerce_api import (
 	WooCommerceAPI,
 	WooCommerceResource,
@@ -63,13 +63,7 @@ class WooCommerceOrder(WooCommerceResource):
 
 		wc_api_list = [
 			WooCommerceOrderAPI(
-				api=APIWithRequestLogging(
-					url=server.woocommerce_server_url,
-					consumer_key=server.api_consumer_key,
-					consumer_secret=server.api_consumer_secret,
-					version="wc/v3",
-					timeout=40,
-				),
+				api=get_woocommerce_api(server),
 				woocommerce_server_url=server.woocommerce_server_url,
 				woocommerce_server=server.name,
 				wc_plugin_advanced_shipment_tracking=server.wc_plugin_advanced_shipment_tracking,
@@ -2,7 +2,7 @@
 # For license information, please see license.txt
 
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Iterator
 
 from woocommerce_fusion.woocommerce.woocommerce_api import WooCommerceAPI, WooCommerceResource
 
@@ -41,6 +41,22 @@ class WooCommerceProduct(WooCommerceResource):
 
 		return products
 
+	# use "args" despite frappe-semgrep-rules.rules.overusing-args, following convention in ERPNext
+	# nosemgrep
+	@classmethod
+	def iter_records_from_api(cls, wc_server: WooCommerceAPI, args) -> Iterator[Dict]:
+		"""
+		Yields all WooCommerce Products from a single API, each variable product followed by its variants
+		"""
+		for product in super().iter_records_from_api(wc_server, args):
+			yield product
+
+			# Variants are always fetched from the first page, regardless of the page of their product
+			if product.get("type") == "variable":
+				yield from super().iter_records_from_api(
+					wc_server, {**args, "endpoint": f"products/{product['id']}/variations"}
+				)
+
 	def after_load_from_db(self, product: Dict):
 		product.pop("name")
 		product = self.set_title(product)
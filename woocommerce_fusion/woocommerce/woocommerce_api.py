@@ -1,6 +1,6 @@
 import json
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import frappe
@@ -8,7 +8,7 @@ from frappe import _
 from frappe.model.document import Document
 
 from woocommerce_fusion.exceptions import SyncDisabledError
-from woocommerce_fusion.tasks.utils import APIWithRequestLogging
+from woocommerce_fusion.tasks.utils import APIWithRequestLogging, get_woocommerce_api
 
 WC_RESOURCE_DELIMITER = "~"
 
@@ -41,13 +41,7 @@ class WooCommerceResource(Document):
 
 		wc_api_list = [
 			WooCommerceAPI(
-				api=APIWithRequestLogging(
-					url=server.woocommerce_server_url,
-					consumer_key=server.api_consumer_key,
-					consumer_secret=server.api_consumer_secret,
-					version="wc/v3",
-					timeout=40,
-				),
+				api=get_woocommerce_api(server),
 				woocommerce_server_url=server.woocommerce_server_url,
 				woocommerce_server=server.name,
 			)
@@ -214,6 +208,60 @@ class WooCommerceResource(Document):
 			else:
 				return all_results
 
+	# use "args" despite frappe-semgrep-rules.rules.overusing-args, following convention in ERPNext
+	# nosemgrep
+	@classmethod
+	def iter_records(cls, args) -> Iterator[Dict]:
+		"""
+		Yields all WooCommerce Records matching the filters, server by server.
+
+		Unlike get_list_of_records, each page is requested directly at its offset, so every page
+		is fetched exactly once, regardless of how deep into the result set it is.
+		"""
+		for wc_server in cls._init_api():
+			# Skip this API if one or more servers were specified
+			if args.get("servers", None) and wc_server.woocommerce_server not in args["servers"]:
+				continue
+
+			yield from cls.iter_records_from_api(wc_server, args)
+
+	# use "args" despite frappe-semgrep-rules.rules.overusing-args, following convention in ERPNext
+	# nosemgrep
+	@classmethod
+	def iter_records_from_api(cls, wc_server: WooCommerceAPI, args) -> Iterator[Dict]:
+		"""
+		Yields all WooCommerce Records matching the filters from a single API, one page at a time
+		"""
+		wc_records_per_page_limit = 100
+
+		# Map Frappe filters to WooCommerce parameters
+		filter_params = {}
+		if "filters" in args and args["filters"]:
+			filter_params = get_wc_parameters_from_filters(args["filters"])
+
+		endpoint = args["endpoint"] if "endpoint" in args else cls.resource
+		offset = 0
+		while True:
+			# Get WooCommerce Records
+			params = {**filter_params, "per_page": wc_records_per_page_limit, "offset": offset}
+			try:
+				response = wc_server.api.get(endpoint, params=params)
+			except Exception as err:
+				log_and_raise_error(err, error_text="get_list failed")
+			if response.status_code != 200:
+				log_and_raise_error(error_text="get_list failed", response=response)
+			results = response.json()
+
+			# Add frappe fields to records
+			for record in results:
+				cls.pre_init_document(record=record, woocommerce_server_url=wc_server.woocommerce_server_url)
+				yield cls.during_get_list_of_records(record)
+
+			# Stop when the last page has been reached
+			if len(results) < wc_records_per_page_limit:
+				break
+			offset += wc_records_per_page_limit
+
 	@classmethod
 	def during_get_list_of_records(cls, record: Document):
 		return record